@@ -1,16 +1,126 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Request, UploadFile, File, HTTPException
+from fastapi.responses import FileResponse, Response, StreamingResponse
+import asyncio
 import os
-import shutil
 import uuid
-from datetime import datetime
-from typing import Dict, Any
-import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Dict, Any, Optional
+
+from app import model_store
+from app import uring_writer
+
+# aiofiles позволяет писать на диск, не блокируя event loop
+try:
+    import aiofiles
+    HAS_AIOFILES = True
+except ImportError:
+    HAS_AIOFILES = False
 
 router = APIRouter()
 
-# Хранилище статусов задач (временно в памяти, для production использовать БД)
-tasks_storage: Dict[str, Dict[str, Any]] = {}
+# Размер чанка при загрузке файла (4 МБ) - память не зависит от размера файла
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _cache_headers(path: str) -> Dict[str, str]:
+    """
+    Заголовки условного кэширования для файла: слабый ETag по mtime+размеру
+    (не требует чтения содержимого) + Last-Modified
+    """
+    st = os.stat(path)
+    return {
+        "ETag": f'W/"{st.st_mtime_ns}-{st.st_size}"',
+        "Last-Modified": format_datetime(
+            datetime.fromtimestamp(st.st_mtime, tz=timezone.utc), usegmt=True
+        ),
+        "Cache-Control": "private, must-revalidate",
+    }
+
+
+def _not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """
+    Проверка валидатора клиента: совпал ETag - можно отдать 304 без тела
+    """
+    return request.headers.get("if-none-match") == headers["ETag"]
+
+
+def _parse_range(range_header: str, file_size: int):
+    """
+    Разбор заголовка 'Range: bytes=a-b'; None - диапазон некорректен
+    """
+    if not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].split(",")[0].strip()
+    start_s, _, end_s = spec.partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else file_size - 1
+        else:
+            # Суффиксный диапазон: последние N байт; если N больше файла,
+            # по RFC 7233 отдаётся весь файл
+            start = max(file_size - int(end_s), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+    if start < 0 or start > end:
+        return None
+    # Диапазон, начинающийся на конце файла или за ним, невыполним (416)
+    if start >= file_size:
+        return None
+    return start, min(end, file_size - 1)
+
+
+def _iter_file_range(path: str, start: int, end: int, chunk_size: int = 4 * 1024 * 1024):
+    """
+    Чтение диапазона файла блоками по 4 МБ
+    """
+    remaining = end - start + 1
+    with open(path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+@dataclass(slots=True)
+class Task:
+    """
+    Состояние задачи конвертации. slots=True - фиксированный набор полей
+    вместо dict на задачу (меньше памяти, опечатка в имени поля = ошибка)
+    """
+    id: str
+    filename: str
+    status: str
+    created_at: str
+    file_path: str
+    error: Optional[str] = None
+    result: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Представление для API-ответа: базовые поля + результат обработки
+        """
+        data = {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "created_at": self.created_at,
+            "file_path": self.file_path,
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        data.update(self.result)
+        return data
+
+
+# Хранилище статусов задач (временно в памяти, для production использовать
+# БД или Redis - текущий dict не разделяется между worker'ами uvicorn)
+tasks_storage: Dict[str, Task] = {}
 
 @router.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
@@ -27,18 +137,29 @@ async def upload_file(file: UploadFile = File(...)):
     # Путь для сохранения файла
     upload_path = f"uploads/{task_id}.e57"
     
-    # Сохраняем файл
-    with open(upload_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Сохраняем файл по частям, чтобы не держать весь E57 в памяти.
+    # На Linux с liburing запись идёт батчами через io_uring (меньше syscalls)
+    if uring_writer.available():
+        with uring_writer.UringFileWriter(upload_path) as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                out.write(chunk)
+    elif HAS_AIOFILES:
+        async with aiofiles.open(upload_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await out.write(chunk)
+    else:
+        with open(upload_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                out.write(chunk)
     
     # Создаём запись о задаче
-    tasks_storage[task_id] = {
-        "id": task_id,
-        "filename": file.filename,
-        "status": "uploaded",
-        "created_at": datetime.now().isoformat(),
-        "file_path": upload_path
-    }
+    tasks_storage[task_id] = Task(
+        id=task_id,
+        filename=file.filename,
+        status="uploaded",
+        created_at=datetime.now().isoformat(),
+        file_path=upload_path
+    )
     
     return {
         "task_id": task_id,
@@ -54,8 +175,8 @@ async def get_status(task_id: str):
     """
     if task_id not in tasks_storage:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    
-    return tasks_storage[task_id]
+
+    return tasks_storage[task_id].to_dict()
 
 @router.post("/process/{task_id}")
 async def process_task(task_id: str):
@@ -65,45 +186,57 @@ async def process_task(task_id: str):
     if task_id not in tasks_storage:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     
+    task = tasks_storage[task_id]
+
     # Обновляем статус
-    tasks_storage[task_id]["status"] = "processing"
-    
+    task.status = "processing"
+
     # Импортируем и запускаем обработку
     from app.processing import process_point_cloud
-    
+
     try:
         result = process_point_cloud(task_id)
-        
+
         # Обновляем информацию о задаче
-        tasks_storage[task_id].update(result)
-        
+        task.status = result["status"]
+        task.result = result
+
         return {
             "task_id": task_id,
             "status": result["status"],
             "message": result["message"]
         }
     except Exception as e:
-        tasks_storage[task_id]["status"] = "error"
-        tasks_storage[task_id]["error"] = str(e)
+        task.status = "error"
+        task.error = str(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/model/{task_id}")
-async def get_model(task_id: str):
+async def get_model(task_id: str, request: Request):
     """
     Получить данные модели (облако точек + IFC объекты)
     """
     if task_id not in tasks_storage:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     
-    model_path = f"models/{task_id}.json"
-    
-    if not os.path.exists(model_path):
+    if not model_store.model_exists(task_id):
         raise HTTPException(status_code=404, detail="Модель еще не создана")
-    
-    with open(model_path, "r") as f:
-        model_data = json.load(f)
-    
-    return model_data
+
+    headers = _cache_headers(model_store.model_path(task_id))
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    # Чтение и парсинг модели - блокирующие операции; уводим их в
+    # threadpool, чтобы не останавливать event loop на больших файлах
+    loop = asyncio.get_running_loop()
+    raw = await loop.run_in_executor(None, model_store.load_model_json_bytes, task_id)
+
+    # Отдаём закэшированные JSON-байты напрямую, минуя сериализацию FastAPI
+    return Response(
+        content=raw,
+        media_type="application/json",
+        headers=headers
+    )
 
 @router.put("/model/{task_id}")
 async def update_model(task_id: str, updates: Dict[str, Any]):
@@ -113,22 +246,19 @@ async def update_model(task_id: str, updates: Dict[str, Any]):
     if task_id not in tasks_storage:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     
-    model_path = f"models/{task_id}.json"
-    
-    if not os.path.exists(model_path):
+    if not model_store.model_exists(task_id):
         raise HTTPException(status_code=404, detail="Модель не найдена")
-    
-    # Загружаем текущую модель
-    with open(model_path, "r") as f:
-        model_data = json.load(f)
-    
+
+    # Загружаем текущую модель (в threadpool - не блокируем event loop)
+    loop = asyncio.get_running_loop()
+    model_data = await loop.run_in_executor(None, model_store.load_model, task_id)
+
     # Обновляем параметры (простая логика для MVP)
     # TODO: Добавить валидацию и более сложную логику обновления
     model_data.update(updates)
-    
+
     # Сохраняем обновленную модель
-    with open(model_path, "w") as f:
-        json.dump(model_data, f, indent=2)
+    await loop.run_in_executor(None, model_store.save_model, task_id, model_data)
     
     return {
         "task_id": task_id,
@@ -137,21 +267,49 @@ async def update_model(task_id: str, updates: Dict[str, Any]):
     }
 
 @router.get("/export/{task_id}")
-async def export_ifc(task_id: str):
+async def export_ifc(task_id: str, request: Request):
     """
     Экспортировать IFC4 файл
     """
     if task_id not in tasks_storage:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    
+
     ifc_path = f"exports/{task_id}.ifc"
-    
+
     if not os.path.exists(ifc_path):
         raise HTTPException(status_code=404, detail="IFC файл еще не создан")
-    
-    # Возвращаем файл для скачивания
+
+    headers = _cache_headers(ifc_path)
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    # Докачка/параллельная загрузка больших IFC по частям
+    headers["Accept-Ranges"] = "bytes"
+    file_size = os.stat(ifc_path).st_size
+
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = _parse_range(range_header, file_size)
+        if byte_range is None:
+            return Response(
+                status_code=416,
+                headers={"Content-Range": f"bytes */{file_size}"}
+            )
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file_range(ifc_path, start, end),
+            status_code=206,
+            media_type="application/x-step",
+            headers=headers
+        )
+
+    # Возвращаем файл целиком (FileResponse использует sendfile)
     return FileResponse(
         path=ifc_path,
-        filename=f"{tasks_storage[task_id]['filename']}.ifc",
-        media_type="application/x-step"
+        filename=f"{tasks_storage[task_id].filename}.ifc",
+        media_type="application/x-step",
+        headers=headers,
+        stat_result=os.stat(ifc_path)
     )
\ No newline at end of file
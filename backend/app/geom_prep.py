@@ -0,0 +1,60 @@
+import numpy as np
+
+# Numba JIT-компилирует числовую подготовку геометрии; без него
+# используется векторизованная numpy-реализация с той же семантикой
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _prep_walls_numpy(starts: np.ndarray, ends: np.ndarray, min_len: float) -> np.ndarray:
+    """
+    Векторизованная подготовка параметров стен: длина, cos, sin, флаг keep
+    """
+    d = ends - starts
+    lengths = np.hypot(d[:, 0], d[:, 1])
+    keep = lengths >= min_len
+    # Для отброшенных стен направление не важно - избегаем деления на ноль
+    safe = np.where(lengths > 0.0, lengths, 1.0)
+    out = np.empty((starts.shape[0], 4), dtype=np.float64)
+    out[:, 0] = lengths
+    out[:, 1] = d[:, 0] / safe
+    out[:, 2] = d[:, 1] / safe
+    out[:, 3] = keep
+    return out
+
+
+if HAS_NUMBA:
+    @njit(cache=True, fastmath=True)
+    def _prep_walls_jit(starts, ends, min_len):
+        n = starts.shape[0]
+        out = np.empty((n, 4), dtype=np.float64)
+        for i in range(n):
+            dx = ends[i, 0] - starts[i, 0]
+            dy = ends[i, 1] - starts[i, 1]
+            L = (dx * dx + dy * dy) ** 0.5
+            if L < min_len:
+                out[i, 0] = 0.0
+                out[i, 1] = 1.0
+                out[i, 2] = 0.0
+                out[i, 3] = 0.0
+                continue
+            out[i, 0] = L
+            out[i, 1] = dx / L
+            out[i, 2] = dy / L
+            out[i, 3] = 1.0
+        return out
+
+
+def prep_walls(starts: np.ndarray, ends: np.ndarray, min_len: float = 0.1) -> np.ndarray:
+    """
+    Параметры геометрии стен одним проходом: массив (N, 4) со столбцами
+    [длина, cos угла, sin угла, keep]. keep == 0 - стена короче min_len
+    """
+    starts = np.ascontiguousarray(starts, dtype=np.float64)
+    ends = np.ascontiguousarray(ends, dtype=np.float64)
+    if HAS_NUMBA:
+        return _prep_walls_jit(starts, ends, min_len)
+    return _prep_walls_numpy(starts, ends, min_len)
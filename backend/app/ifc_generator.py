@@ -1,8 +1,61 @@
 import ifcopenshell
 import ifcopenshell.api
+import ifcopenshell.guid
+import glob
+import numpy as np
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Any
-import json
+
+from app import geom_prep
+from app import model_store
+from app import step_writer
+
+# Минимальная длина стены (м) - более короткие отбрасываются
+MIN_WALL_LENGTH = 0.1
+
+# Размер блока при записи IFC-файла (16 МБ) - меньше syscalls на больших файлах
+IFC_WRITE_BUFFER = 16 << 20
+
+# С какого количества элементов включать параллельную генерацию
+# (меньше - накладные расходы на запуск пула не окупаются)
+PARALLEL_MIN_ELEMENTS = 512
+
+# Сколько IFC-файлов со старыми хэшами модели хранить на задачу
+IFC_CACHE_KEEP = 4
+
+
+def _build_walls_partial(walls: List[Dict[str, Any]], params: List[List[float]]) -> str:
+    """
+    Worker для пула процессов: строит частичный IFC-файл только со стенами
+    своего чанка и возвращает его как STEP-строку. Этаж кодируется в Tag
+    """
+    gen = IFCGenerator.__new__(IFCGenerator)
+    gen.ifc_file = ifcopenshell.file(schema="IFC4")
+    gen._dir_cache = {}
+    gen._pt_cache = {}
+    gen._profile_cache = {}
+    gen._pending = defaultdict(list)
+    gen._owner = None
+    gen.storeys = {0: None}
+    # Временный контекст; при слиянии representations перевешиваются
+    # на контекст основного файла
+    gen.body_context = gen.ifc_file.create_entity(
+        "IfcGeometricRepresentationContext",
+        ContextType="Model",
+        CoordinateSpaceDimension=3,
+        Precision=1e-5
+    )
+
+    for wall_data, p in zip(walls, params):
+        wall = gen.create_wall(wall_data, p[0], p[1], p[2])
+        if wall is not None:
+            wall.Tag = str(wall_data.get('storey', 0))
+
+    return gen.ifc_file.to_string()
 
 class IFCGenerator:
     """
@@ -11,19 +64,151 @@ class IFCGenerator:
     
     def __init__(self, task_id: str):
         self.task_id = task_id
-        self.model_path = f"models/{task_id}.json"
+        self.model_path = model_store.model_path(task_id)
         self.ifc_file = None
         self.project = None
         self.site = None
         self.building = None
         self.storey = None
-        
+        # Кэши общих сущностей: одинаковые направления/точки переиспользуются
+        # вместо создания дубликатов на каждый элемент
+        self._dir_cache = {}
+        self._pt_cache = {}
+        self._profile_cache = {}
+        # Элементы, ожидающие привязки к этажу: один assign_container
+        # на этаж вместо одного на элемент
+        self._pending = defaultdict(list)
+
+    def _dir(self, ratios):
+        """
+        Общая сущность IfcDirection для заданного направления
+        """
+        d = self._dir_cache.get(ratios)
+        if d is None:
+            d = self.ifc_file.create_entity("IfcDirection", DirectionRatios=ratios)
+            self._dir_cache[ratios] = d
+        return d
+
+    def _pt(self, coords):
+        """
+        Общая сущность IfcCartesianPoint для заданных координат
+        """
+        p = self._pt_cache.get(coords)
+        if p is None:
+            p = self.ifc_file.create_entity("IfcCartesianPoint", Coordinates=coords)
+            self._pt_cache[coords] = p
+        return p
+
+    def _rect_profile(self, xdim: float, ydim: float):
+        """
+        Общий IfcRectangleProfileDef для заданного сечения: сотни колонн
+        стандартного размера получают один профиль вместо дубликатов
+        """
+        key = (round(xdim, 4), round(ydim, 4))
+        profile = self._profile_cache.get(key)
+        if profile is None:
+            profile = self.ifc_file.create_entity("IfcRectangleProfileDef",
+                ProfileType="AREA",
+                XDim=key[0],
+                YDim=key[1]
+            )
+            self._profile_cache[key] = profile
+        return profile
+
+    def _create_element(self, ifc_class: str, name: str):
+        """
+        Быстрое создание элемента без api.run: готовый GUID и общая история
+        """
+        return self.ifc_file.create_entity(ifc_class,
+            GlobalId=ifcopenshell.guid.new(),
+            OwnerHistory=self._owner,
+            Name=name
+        )
+
+    def _merge_walls_partial(self, step_str: str):
+        """
+        Слияние частичного файла из worker'а: стены добавляются через
+        file.add, привязка к этажу восстанавливается из Tag
+        """
+        sub = ifcopenshell.file.from_string(step_str)
+        for wall in sub.by_type("IfcWall"):
+            merged = self.ifc_file.add(wall)
+            storey_idx = int(merged.Tag or 0)
+            merged.Tag = None
+            target_storey = self.storeys.get(storey_idx, self.storeys[0])
+            self._pending[target_storey].append(merged)
+
+    def _fix_merged_contexts(self):
+        """
+        После слияния частичных файлов: перевешиваем все representations
+        на общий Body-контекст и удаляем продублированные контексты
+        """
+        keep = {self.body_context.id(), self.body_context.ParentContext.id()}
+        for rep in self.ifc_file.by_type("IfcShapeRepresentation"):
+            rep.ContextOfItems = self.body_context
+        for ctx in self.ifc_file.by_type("IfcGeometricRepresentationContext"):
+            if ctx.id() not in keep:
+                self.ifc_file.remove(ctx)
+
+    def _create_walls_parallel(self, walls: List[Dict[str, Any]], params: np.ndarray):
+        """
+        Создание стен в пуле процессов: каждый worker строит частичный
+        файл со своим чанком, результаты сливаются через file.add
+        """
+        workers = os.cpu_count() or 1
+        chunk_size = max(1, len(walls) // workers)
+        chunks = []
+        for i in range(0, len(walls), chunk_size):
+            chunk_walls = walls[i:i + chunk_size]
+            chunk_params = params[i:i + chunk_size].tolist()
+            # Отбрасываем короткие стены до отправки в worker
+            kept = [(w, p) for w, p in zip(chunk_walls, chunk_params) if p[3] != 0.0]
+            if kept:
+                chunks.append(([w for w, _ in kept], [p for _, p in kept]))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for step_str in pool.map(_build_walls_partial, *zip(*chunks)):
+                self._merge_walls_partial(step_str)
+
+        self._fix_merged_contexts()
+
     def load_model_data(self) -> Dict[str, Any]:
         """
-        Загрузка данных модели из JSON
+        Загрузка данных модели из хранилища
+        """
+        return model_store.load_model(self.task_id)
+
+    def _finish_export(self, cached_path: str, final_path: str):
+        """
+        Копия хэшированного файла под финальным именем + подрезка
+        старых кэшированных версий (оставляем последние IFC_CACHE_KEEP)
+        """
+        shutil.copyfile(cached_path, final_path)
+        cached = sorted(glob.glob(f"exports/{self.task_id}.*.ifc"),
+                        key=os.path.getmtime)
+        for old in cached[:-IFC_CACHE_KEEP]:
+            os.remove(old)
+
+    def _write_ifc(self, output_path: str):
+        """
+        Запись IFC крупными блоками через 16 МБ буфер. Файл пишется один
+        раз и больше не читается - после записи советуем ядру освободить
+        его страницы из page cache (posix_fadvise DONTNEED)
         """
-        with open(self.model_path, 'r') as f:
-            return json.load(f)
+        try:
+            data = self.ifc_file.to_string().encode("utf-8")
+        except AttributeError:
+            # Старые версии ifcopenshell без to_string
+            self.ifc_file.write(output_path)
+            return
+
+        with open(output_path, "wb", buffering=IFC_WRITE_BUFFER) as f:
+            for offset in range(0, len(data), IFC_WRITE_BUFFER):
+                f.write(data[offset:offset + IFC_WRITE_BUFFER])
+            f.flush()
+            if hasattr(os, "posix_fadvise"):
+                os.fsync(f.fileno())
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
     
     def create_ifc_structure(self, storeys_count: int = 1):
         """
@@ -31,7 +216,10 @@ class IFCGenerator:
         """
         # Создаем новый IFC4 файл
         self.ifc_file = ifcopenshell.file(schema="IFC4")
-        
+        self._dir_cache.clear()
+        self._pt_cache.clear()
+        self._profile_cache.clear()
+
         # Создаем Project
         self.project = ifcopenshell.api.run("root.create_entity", self.ifc_file, 
             ifc_class="IfcProject",
@@ -47,11 +235,27 @@ class IFCGenerator:
         )
         
         body = ifcopenshell.api.run("context.add_context", self.ifc_file,
-            context_type="Model", 
+            context_type="Model",
             context_identifier="Body",
-            target_view="MODEL_VIEW", 
+            target_view="MODEL_VIEW",
             parent=context
         )
+        # Сохраняем subcontext, чтобы не искать его через by_type на каждый элемент
+        self.body_context = body
+
+        # Общая IfcOwnerHistory для всех элементов: позволяет создавать
+        # стены/плиты/колонны напрямую через create_entity, минуя
+        # диспетчер api.run на каждый элемент
+        histories = self.ifc_file.by_type("IfcOwnerHistory")
+        self._owner = histories[0] if histories else None
+
+        # Общее размещение в начале координат (Z вверх, X вправо) -
+        # одно на файл вместо трёх сущностей на каждую экструзию
+        self._origin_placement = self.ifc_file.create_entity("IfcAxis2Placement3D",
+            Location=self._pt((0.0, 0.0, 0.0)),
+            Axis=self._dir((0.0, 0.0, 1.0)),
+            RefDirection=self._dir((1.0, 0.0, 0.0))
+        )
         
         # Создаем Site
         self.site = ifcopenshell.api.run("root.create_entity", self.ifc_file,
@@ -104,10 +308,7 @@ class IFCGenerator:
         """
         Создание плиты (IfcSlab) с геометрией
         """
-        slab = ifcopenshell.api.run("root.create_entity", self.ifc_file,
-            ifc_class="IfcSlab",
-            name=f"Slab at Z={slab_data['z']:.2f}"
-        )
+        slab = self._create_element("IfcSlab", f"Slab at Z={slab_data['z']:.2f}")
         
         z_level = slab_data['z']
         thickness = slab_data['thickness']
@@ -121,28 +322,16 @@ class IFCGenerator:
         center_x = (max_bounds[0] + min_bounds[0]) / 2
         center_y = (max_bounds[1] + min_bounds[1]) / 2
         
-        # Получаем контекст
-        context = self.ifc_file.by_type("IfcGeometricRepresentationSubContext")[0]
+        context = self.body_context
         
-        # Создаем прямоугольный профиль плиты
-        rectangle = self.ifc_file.create_entity("IfcRectangleProfileDef",
-            ProfileType="AREA",
-            XDim=length,
-            YDim=width
-        )
+        # Прямоугольный профиль плиты (общий для одинаковых сечений)
+        rectangle = self._rect_profile(length, width)
         
-        # Позиция экструзии
-        extrusion_position = self.ifc_file.create_entity("IfcAxis2Placement3D",
-            Location=self.ifc_file.create_entity("IfcCartesianPoint", Coordinates=(0.0, 0.0, 0.0)),
-            Axis=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0)),
-            RefDirection=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(1.0, 0.0, 0.0))
-        )
-        
-        # Экструдированная геометрия
+        # Экструдированная геометрия (позиция - общее размещение в начале координат)
         extrusion = self.ifc_file.create_entity("IfcExtrudedAreaSolid",
             SweptArea=rectangle,
-            Position=extrusion_position,
-            ExtrudedDirection=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0)),
+            Position=self._origin_placement,
+            ExtrudedDirection=self._dir((0.0, 0.0, 1.0)),
             Depth=thickness
         )
         
@@ -161,78 +350,62 @@ class IFCGenerator:
         slab.Representation = product_shape
         
         # Размещение плиты
-        placement_location = self.ifc_file.create_entity("IfcCartesianPoint", 
-            Coordinates=(center_x, center_y, z_level)
-        )
-        
         axis_placement = self.ifc_file.create_entity("IfcAxis2Placement3D",
-            Location=placement_location
+            Location=self._pt((center_x, center_y, z_level))
         )
         
         slab.ObjectPlacement = self.ifc_file.create_entity("IfcLocalPlacement",
             RelativePlacement=axis_placement
         )
         
-        ifcopenshell.api.run("spatial.assign_container", self.ifc_file,
-            relating_structure=self.storeys[0],
-            products=[slab]
-        )
-        
+        self._pending[self.storeys[0]].append(slab)
+
         return slab
     
-    def create_wall(self, wall_data: Dict[str, Any]):
+    def create_wall(self, wall_data: Dict[str, Any], length: float = None,
+                    cos_angle: float = None, sin_angle: float = None):
         """
-        Создание стены (IfcWall) с правильной геометрией и ориентацией
+        Создание стены (IfcWall) с правильной геометрией и ориентацией.
+        length/cos_angle/sin_angle могут быть посчитаны заранее
+        (векторизованно для всех стен сразу в generate())
         """
         import math
-        
-        wall = ifcopenshell.api.run("root.create_entity", self.ifc_file,
-            ifc_class="IfcWall",
-            name="Wall"
-        )
-        
+
         start = wall_data['start']
         end = wall_data['end']
         height = wall_data['height']
         thickness = wall_data['thickness']
+
+        if length is None:
+            # Скалярный fallback для одиночного вызова
+            dx = end[0] - start[0]
+            dy = end[1] - start[1]
+            length = math.sqrt(dx**2 + dy**2)
+            if length < MIN_WALL_LENGTH:  # Слишком короткая стена
+                return None
+            angle = math.atan2(dy, dx)
+            cos_angle = math.cos(angle)
+            sin_angle = math.sin(angle)
+
+        wall = self._create_element("IfcWall", "Wall")
+
+        context = self.body_context
         
-        # Вычисляем длину и угол стены
-        dx = end[0] - start[0]
-        dy = end[1] - start[1]
-        length = math.sqrt(dx**2 + dy**2)
-        
-        if length < 0.1:  # Слишком короткая стена
-            return None
-        
-        # Вычисляем угол поворота стены
-        angle = math.atan2(dy, dx)
-        
-        # Направления для правильной ориентации
-        cos_angle = math.cos(angle)
-        sin_angle = math.sin(angle)
-        
-        # Получаем контекст
-        context = self.ifc_file.by_type("IfcGeometricRepresentationSubContext")[0]
-        
-        # Создаем прямоугольный профиль стены
-        rectangle = self.ifc_file.create_entity("IfcRectangleProfileDef",
-            ProfileType="AREA",
-            XDim=length,
-            YDim=thickness
-        )
+        # Прямоугольный профиль стены (общий для одинаковых сечений)
+        rectangle = self._rect_profile(length, thickness)
         
         # Позиция экструзии (в начале стены)
         extrusion_position = self.ifc_file.create_entity("IfcAxis2Placement3D",
-            Location=self.ifc_file.create_entity("IfcCartesianPoint", Coordinates=(0.0, -thickness/2, 0.0)),
-            Axis=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0)),
-            RefDirection=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(1.0, 0.0, 0.0))
+            Location=self._pt((0.0, -thickness/2, 0.0)),
+            Axis=self._dir((0.0, 0.0, 1.0)),
+            RefDirection=self._dir((1.0, 0.0, 0.0))
         )
-        
+
         # Экструдированная геометрия
         extrusion = self.ifc_file.create_entity("IfcExtrudedAreaSolid",
             SweptArea=rectangle,
             Position=extrusion_position,
-            ExtrudedDirection=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0)),
+            ExtrudedDirection=self._dir((0.0, 0.0, 1.0)),
             Depth=height
         )
         
@@ -251,22 +424,10 @@ class IFCGenerator:
         wall.Representation = product_shape
         
         # Размещение стены в пространстве с правильным поворотом
-        placement_location = self.ifc_file.create_entity("IfcCartesianPoint", 
-            Coordinates=(start[0], start[1], start[2])
-        )
-        
-        placement_axis = self.ifc_file.create_entity("IfcDirection", 
-            DirectionRatios=(0.0, 0.0, 1.0)
-        )
-        
-        placement_ref_direction = self.ifc_file.create_entity("IfcDirection", 
-            DirectionRatios=(cos_angle, sin_angle, 0.0)
-        )
-        
         axis_placement = self.ifc_file.create_entity("IfcAxis2Placement3D",
-            Location=placement_location,
-            Axis=placement_axis,
-            RefDirection=placement_ref_direction
+            Location=self._pt((start[0], start[1], start[2])),
+            Axis=self._dir((0.0, 0.0, 1.0)),
+            RefDirection=self._dir((cos_angle, sin_angle, 0.0))
         )
         
         wall.ObjectPlacement = self.ifc_file.create_entity("IfcLocalPlacement",
@@ -276,50 +437,32 @@ class IFCGenerator:
         # Определяем этаж для размещения
         storey_idx = wall_data.get('storey', 0)
         target_storey = self.storeys.get(storey_idx, self.storeys[0])
-        
-        ifcopenshell.api.run("spatial.assign_container", self.ifc_file,
-            relating_structure=target_storey,
-            products=[wall]
-        )
-        
+
+        self._pending[target_storey].append(wall)
+
         return wall
     
     def create_column(self, column_data: Dict[str, Any]):
         """
         Создание колонны (IfcColumn) с геометрией
         """
-        column = ifcopenshell.api.run("root.create_entity", self.ifc_file,
-            ifc_class="IfcColumn",
-            name="Column"
-        )
+        column = self._create_element("IfcColumn", "Column")
         
         position = column_data['position']
         height = column_data['height']
         width = column_data['width']
         depth = column_data['depth']
         
-        # Получаем контекст
-        context = self.ifc_file.by_type("IfcGeometricRepresentationSubContext")[0]
-        
-        # Создаем прямоугольный профиль колонны
-        rectangle = self.ifc_file.create_entity("IfcRectangleProfileDef",
-            ProfileType="AREA",
-            XDim=width,
-            YDim=depth
-        )
+        context = self.body_context
         
-        # Позиция экструзии
-        extrusion_position = self.ifc_file.create_entity("IfcAxis2Placement3D",
-            Location=self.ifc_file.create_entity("IfcCartesianPoint", Coordinates=(0.0, 0.0, 0.0)),
-            Axis=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0)),
-            RefDirection=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(1.0, 0.0, 0.0))
-        )
+        # Прямоугольный профиль колонны (общий для одинаковых сечений)
+        rectangle = self._rect_profile(width, depth)
         
-        # Экструдированная геометрия
+        # Экструдированная геометрия (позиция - общее размещение в начале координат)
         extrusion = self.ifc_file.create_entity("IfcExtrudedAreaSolid",
             SweptArea=rectangle,
-            Position=extrusion_position,
-            ExtrudedDirection=self.ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0)),
+            Position=self._origin_placement,
+            ExtrudedDirection=self._dir((0.0, 0.0, 1.0)),
             Depth=height
         )
         
@@ -338,12 +481,8 @@ class IFCGenerator:
         column.Representation = product_shape
         
         # Размещение колонны
-        placement_location = self.ifc_file.create_entity("IfcCartesianPoint", 
-            Coordinates=(position[0], position[1], position[2])
-        )
-        
         axis_placement = self.ifc_file.create_entity("IfcAxis2Placement3D",
-            Location=placement_location
+            Location=self._pt((position[0], position[1], position[2]))
         )
         
         column.ObjectPlacement = self.ifc_file.create_entity("IfcLocalPlacement",
@@ -353,12 +492,9 @@ class IFCGenerator:
         # Определяем этаж для размещения
         storey_idx = column_data.get('storey', 0)
         target_storey = self.storeys.get(storey_idx, self.storeys[0])
-        
-        ifcopenshell.api.run("spatial.assign_container", self.ifc_file,
-            relating_structure=target_storey,
-            products=[column]
-        )
-        
+
+        self._pending[target_storey].append(column)
+
         return column
     
     def generate(self) -> str:
@@ -370,6 +506,24 @@ class IFCGenerator:
         # 1. Загружаем данные модели
         model_data = self.load_model_data()
         elements = model_data['elements']
+
+        # Мемоизация результата: IFC-файлы кэшируются по хэшу модели,
+        # повторная генерация неизменённой модели - просто копия файла
+        model_hash = model_store.canonical_hash(model_data)
+        final_path = f"exports/{self.task_id}.ifc"
+        cached_path = f"exports/{self.task_id}.{model_hash}.ifc"
+        if os.path.exists(cached_path):
+            shutil.copyfile(cached_path, final_path)
+            print(f"IFC взят из кэша: {cached_path}")
+            return final_path
+
+        # Быстрый путь: прямая сборка STEP-текста без entity API
+        # (opt-in через E57IFC_FAST_STEP=1, см. step_writer)
+        if step_writer.enabled():
+            step_writer.write_step(model_data, cached_path)
+            self._finish_export(cached_path, final_path)
+            print(f"IFC файл сохранен (fast STEP): {final_path}")
+            return final_path
         
         # 2. Создаем структуру IFC
         storeys_count = len(model_data.get('storeys', []))
@@ -381,20 +535,41 @@ class IFCGenerator:
         for slab in elements['slabs']:
             self.create_slab(slab, model_data['bounds'])
         
-        # 4. Создаем стены
-        for wall in elements['walls']:
-            self.create_wall(wall)
+        # 4. Создаем стены - числовую подготовку делает geom_prep
+        # (JIT-кернел Numba или векторизованный numpy) одним проходом
+        walls = elements['walls']
+        if walls:
+            starts = np.asarray([w['start'][:2] for w in walls], dtype=np.float64)
+            ends = np.asarray([w['end'][:2] for w in walls], dtype=np.float64)
+            params = geom_prep.prep_walls(starts, ends, MIN_WALL_LENGTH)
+
+            if len(walls) >= PARALLEL_MIN_ELEMENTS:
+                # Большие модели: фан-аут по ядрам через пул процессов
+                self._create_walls_parallel(walls, params)
+            else:
+                for i, wall in enumerate(walls):
+                    if params[i, 3] != 0.0:
+                        self.create_wall(wall, float(params[i, 0]),
+                                         float(params[i, 1]), float(params[i, 2]))
         
         # 5. Создаем колонны
         for column in elements['columns']:
             self.create_column(column)
-        
-        # 6. Сохраняем IFC файл
-        output_path = f"exports/{self.task_id}.ifc"
-        self.ifc_file.write(output_path)
-        
-        print(f"IFC файл сохранен: {output_path}")
-        return output_path
+
+        # 6. Привязываем элементы к этажам (один вызов на этаж)
+        for storey, products in self._pending.items():
+            ifcopenshell.api.run("spatial.assign_container", self.ifc_file,
+                relating_structure=storey,
+                products=products
+            )
+        self._pending.clear()
+
+        # 7. Сохраняем IFC файл (под именем с хэшем + финальная копия)
+        self._write_ifc(cached_path)
+        self._finish_export(cached_path, final_path)
+
+        print(f"IFC файл сохранен: {final_path}")
+        return final_path
 
 
 def generate_ifc(task_id: str) -> str:
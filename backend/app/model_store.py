@@ -0,0 +1,200 @@
+import copy
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Dict
+
+# Бинарная сериализация (MessagePack) быстрее и компактнее текстового JSON
+try:
+    import ormsgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    import json
+    HAS_ORJSON = False
+
+# Прозрачное сжатие моделей на диске: zstd level 3 распаковывается
+# быстрее, чем читается несжатый файл с SSD
+try:
+    import zstandard as zstd
+    HAS_ZSTD = True
+    # Общие экземпляры; threads=-1 - параллельное сжатие больших моделей
+    _zstd_compressor = zstd.ZstdCompressor(level=3, threads=-1)
+    _zstd_decompressor = zstd.ZstdDecompressor()
+except ImportError:
+    HAS_ZSTD = False
+
+MODELS_DIR = "models"
+
+# Суффикс для новых моделей: бинарный .mpk, если доступен ormsgpack,
+# плюс .zst при доступном zstandard
+MODEL_SUFFIX = (".mpk" if HAS_MSGPACK else ".json") + (".zst" if HAS_ZSTD else "")
+
+# Все суффиксы, которые умеет читать load_model (новые - раньше)
+_KNOWN_SUFFIXES = (".mpk.zst", ".mpk", ".json.zst", ".json")
+
+# LRU-кэш десериализованных моделей: ключ (путь, mtime_ns), значение - dict.
+# mtime в ключе автоматически инвалидирует кэш при перезаписи файла
+_model_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_MODEL_CACHE_MAX = 32
+
+# LRU-кэш готовых JSON-байтов для GET /model: {путь: (mtime_ns, bytes)}.
+# Отдаём клиенту уже сериализованный ответ, минуя повторный json-encode;
+# ограничен так же, как _model_cache - записи здесь крупнее
+_json_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_JSON_CACHE_MAX = 32
+
+
+def model_path(task_id: str) -> str:
+    """
+    Путь к файлу модели: сначала ищем существующий файл
+    (включая legacy .json), иначе возвращаем путь для нового формата
+    """
+    for suffix in _KNOWN_SUFFIXES:
+        path = os.path.join(MODELS_DIR, f"{task_id}{suffix}")
+        if os.path.exists(path):
+            return path
+    return os.path.join(MODELS_DIR, f"{task_id}{MODEL_SUFFIX}")
+
+
+def model_exists(task_id: str) -> bool:
+    """
+    Проверка, создана ли модель для задачи
+    """
+    return os.path.exists(model_path(task_id))
+
+
+def _loads(raw: bytes, path: str) -> Dict[str, Any]:
+    """
+    Десериализация байтов модели по расширению файла
+    """
+    if path.endswith(".zst"):
+        raw = _zstd_decompressor.decompress(raw)
+        path = path[:-len(".zst")]
+    if path.endswith(".mpk"):
+        return ormsgpack.unpackb(raw)
+    if HAS_ORJSON:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
+
+
+def load_model(task_id: str) -> Dict[str, Any]:
+    """
+    Загрузка данных модели (MessagePack или legacy JSON) с кэшированием.
+    Возвращается копия: закэшированный словарь неизменяем, иначе
+    мутации вызывающего кода (PUT /model) попали бы в кэш до - или
+    вместо - записи на диск
+    """
+    path = model_path(task_id)
+    key = (path, os.stat(path).st_mtime_ns)
+
+    if key in _model_cache:
+        _model_cache.move_to_end(key)
+        return copy.deepcopy(_model_cache[key])
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = _loads(raw, path)
+
+    _model_cache[key] = data
+    if len(_model_cache) > _MODEL_CACHE_MAX:
+        _model_cache.popitem(last=False)
+
+    return copy.deepcopy(data)
+
+
+def _invalidate_cache(path: str):
+    """
+    Сброс кэшированных записей для перезаписанного файла
+    """
+    for key in [k for k in _model_cache if k[0] == path]:
+        del _model_cache[key]
+    _json_cache.pop(path, None)
+
+
+def _dumps_json(data: Dict[str, Any]) -> bytes:
+    """
+    Сериализация модели в JSON-байты для HTTP-ответа
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=float).encode("utf-8")
+
+
+def canonical_hash(data: Dict[str, Any]) -> str:
+    """
+    Стабильный хэш модели: сериализация с сортировкой ключей + blake2b.
+    Одинаковые данные дают одинаковый хэш независимо от порядка ключей
+    """
+    if HAS_ORJSON:
+        raw = orjson.dumps(
+            data, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+    else:
+        raw = json.dumps(data, sort_keys=True, default=float).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=12).hexdigest()
+
+
+def load_model_json_bytes(task_id: str) -> bytes:
+    """
+    Готовые JSON-байты модели для отдачи клиенту без повторной сериализации
+    """
+    path = model_path(task_id)
+    mtime_ns = os.stat(path).st_mtime_ns
+
+    cached = _json_cache.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        _json_cache.move_to_end(path)
+        return cached[1]
+
+    if path.endswith(".json"):
+        # Файл уже JSON - отдаём сырые байты с диска
+        with open(path, "rb") as f:
+            raw = f.read()
+    else:
+        raw = _dumps_json(load_model(task_id))
+
+    _json_cache[path] = (mtime_ns, raw)
+    _json_cache.move_to_end(path)
+    if len(_json_cache) > _JSON_CACHE_MAX:
+        _json_cache.popitem(last=False)
+    return raw
+
+
+def save_model(task_id: str, data: Dict[str, Any]) -> str:
+    """
+    Сохранение данных модели в бинарном формате (fallback - JSON)
+    """
+    path = os.path.join(MODELS_DIR, f"{task_id}{MODEL_SUFFIX}")
+
+    # OPT_SERIALIZE_NUMPY: numpy-скаляры из детекторов сериализуются в C,
+    # без float()-кастов на каждый элемент
+    if HAS_MSGPACK:
+        raw = ormsgpack.packb(data, option=ormsgpack.OPT_SERIALIZE_NUMPY)
+    elif HAS_ORJSON:
+        raw = orjson.dumps(
+            data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        )
+    else:
+        raw = json.dumps(data, indent=2, default=float).encode("utf-8")
+
+    if HAS_ZSTD:
+        raw = _zstd_compressor.compress(raw)
+
+    with open(path, "wb") as f:
+        f.write(raw)
+    _invalidate_cache(path)
+
+    # Удаляем файлы той же задачи в устаревших форматах,
+    # чтобы не прочитать старые данные
+    for suffix in _KNOWN_SUFFIXES:
+        stale_path = os.path.join(MODELS_DIR, f"{task_id}{suffix}")
+        if stale_path != path and os.path.exists(stale_path):
+            os.remove(stale_path)
+
+    return path
@@ -1,211 +1,518 @@
 import open3d as o3d
 import numpy as np
 import pye57
-import json
+from scipy.ndimage import maximum_filter
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Any
 
-def detect_slabs(point_cloud: o3d.geometry.PointCloud, z_step: float = 0.05) -> List[Dict[str, Any]]:
+from app import model_store
+
+# Numba JIT-компилирует скан сетки в detect_walls (см. _extract_wall_runs)
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Минимум активных ячеек в линии, чтобы считать её стеной
+MIN_WALL_CELLS = 5
+
+# Порог, после которого перед voxel_down_sample облако прореживается
+# случайной выборкой (ограничивает пик памяти хеш-сетки вокселизации)
+DOWNSAMPLE_PREFILTER_POINTS = 20_000_000
+
+# Пул (n, 3)-буферов точек: повторное использование крупных аллокаций
+# между задачами снижает давление на аллокатор и число page fault'ов
+# при параллельной обработке запросов. Пул ограничен суммарным объёмом,
+# а буферы переиспользуются по ёмкости (срезом), а не по точному размеру
+_buf_pool: List[np.ndarray] = []
+_BUF_POOL_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _get_buf(n: int, dtype=np.float32) -> np.ndarray:
+    """
+    (n, 3)-буфер из пула или новая аллокация: берём наименьший свободный
+    буфер достаточной ёмкости и отдаём его срез. Буфер изымается из пула
+    на время использования, чтобы две задачи не получили один массив
+    """
+    dt = np.dtype(dtype)
+    best = -1
+    for i, buf in enumerate(_buf_pool):
+        if buf.dtype == dt and len(buf) >= n:
+            if best < 0 or len(buf) < len(_buf_pool[best]):
+                best = i
+    if best >= 0:
+        return _buf_pool.pop(best)[:n]
+    return np.empty((n, 3), dtype=dt)
+
+
+def _release_buf(buf: np.ndarray):
+    """
+    Возврат буфера в пул после того, как данные скопированы дальше.
+    Срез разворачивается до исходной аллокации; пул держит не больше
+    _BUF_POOL_MAX_BYTES суммарно, лишнее отдаётся сборщику мусора
+    """
+    base = buf if buf.base is None else buf.base
+    if base.nbytes > _BUF_POOL_MAX_BYTES:
+        return
+    total = base.nbytes + sum(b.nbytes for b in _buf_pool)
+    while _buf_pool and total > _BUF_POOL_MAX_BYTES:
+        total -= _buf_pool.pop(0).nbytes
+    _buf_pool.append(base)
+
+
+def _extract_wall_runs_loop(mask, x_centers, y_centers, min_count):
+    """
+    Скан маски стен: для каждой строки/столбца сетки находит первую и
+    последнюю активные ячейки. Возвращает массив (N, 5):
+    [x_start, y_start, x_end, y_end, количество ячеек]
+    """
+    x_bins, y_bins = mask.shape
+    out = np.empty((x_bins + y_bins, 5), dtype=np.float64)
+    n = 0
+
+    # Линии вдоль X (фиксированный столбец j)
+    for j in range(y_bins):
+        count = 0
+        first = -1
+        last = -1
+        for i in range(x_bins):
+            if mask[i, j]:
+                count += 1
+                if first < 0:
+                    first = i
+                last = i
+        if count > min_count:
+            out[n, 0] = x_centers[first]
+            out[n, 1] = y_centers[j]
+            out[n, 2] = x_centers[last]
+            out[n, 3] = y_centers[j]
+            out[n, 4] = count
+            n += 1
+
+    # Линии вдоль Y (фиксированная строка i)
+    for i in range(x_bins):
+        count = 0
+        first = -1
+        last = -1
+        for j in range(y_bins):
+            if mask[i, j]:
+                count += 1
+                if first < 0:
+                    first = j
+                last = j
+        if count > min_count:
+            out[n, 0] = x_centers[i]
+            out[n, 1] = y_centers[first]
+            out[n, 2] = x_centers[i]
+            out[n, 3] = y_centers[last]
+            out[n, 4] = count
+            n += 1
+
+    return out[:n]
+
+
+def _extract_wall_runs_numpy(mask, x_centers, y_centers, min_count):
+    """
+    Векторный скан той же маски: argmax по прямой и перевёрнутой маске
+    даёт первую и последнюю активные ячейки каждой линии сразу для всех
+    линий, без Python-объекта на ячейку
+    """
+    x_bins, y_bins = mask.shape
+
+    # Линии вдоль X (фиксированный столбец j)
+    counts = mask.sum(axis=0)
+    jj = np.flatnonzero(counts > min_count)
+    first = mask[:, jj].argmax(axis=0)
+    last = x_bins - 1 - mask[::-1, jj].argmax(axis=0)
+    runs_x = np.column_stack([
+        x_centers[first], y_centers[jj],
+        x_centers[last], y_centers[jj], counts[jj]
+    ])
+
+    # Линии вдоль Y (фиксированная строка i)
+    counts = mask.sum(axis=1)
+    ii = np.flatnonzero(counts > min_count)
+    first = mask[ii, :].argmax(axis=1)
+    last = y_bins - 1 - mask[ii, ::-1].argmax(axis=1)
+    runs_y = np.column_stack([
+        x_centers[ii], y_centers[first],
+        x_centers[ii], y_centers[last], counts[ii]
+    ])
+
+    return np.concatenate([runs_x, runs_y])
+
+
+# JIT-кернел со скаляр-циклами при наличии Numba, иначе векторный NumPy
+if HAS_NUMBA:
+    _extract_wall_runs = numba.njit(cache=True)(_extract_wall_runs_loop)
+else:
+    _extract_wall_runs = _extract_wall_runs_numpy
+
+
+if HAS_NUMBA:
+    @numba.njit(parallel=True, cache=True)
+    def _wall_bounds_kernel(points, z_threshold):
+        """
+        XY-границы точек выше порога за один параллельный проход
+        """
+        n = points.shape[0]
+        nt = numba.get_num_threads()
+        mins = np.full((nt, 2), np.inf)
+        maxs = np.full((nt, 2), -np.inf)
+        chunk = (n + nt - 1) // nt
+        for t in numba.prange(nt):
+            for k in range(t * chunk, min(t * chunk + chunk, n)):
+                if points[k, 2] > z_threshold:
+                    x = points[k, 0]
+                    y = points[k, 1]
+                    if x < mins[t, 0]:
+                        mins[t, 0] = x
+                    if x > maxs[t, 0]:
+                        maxs[t, 0] = x
+                    if y < mins[t, 1]:
+                        mins[t, 1] = y
+                    if y > maxs[t, 1]:
+                        maxs[t, 1] = y
+        return mins[:, 0].min(), maxs[:, 0].max(), mins[:, 1].min(), maxs[:, 1].max()
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _fused_histograms_kernel(points, z_min, z_scale, z_bins, z_threshold,
+                                 wx_min, wx_scale, wx_bins,
+                                 wy_min, wy_scale, wy_bins,
+                                 cx_min, cx_scale, cx_bins,
+                                 cy_min, cy_scale, cy_bins):
+        """
+        Все три гистограммы сегментации (высоты, стены, колонны) одним
+        параллельным проходом по облаку: точка читается из памяти один
+        раз вместо трёх. Каждый поток копит локальные гистограммы,
+        редукция - в конце
+        """
+        n = points.shape[0]
+        nt = numba.get_num_threads()
+        z_hist = np.zeros((nt, z_bins), dtype=np.int64)
+        w_hist = np.zeros((nt, wx_bins * wy_bins), dtype=np.int64)
+        c_hist = np.zeros((nt, cx_bins * cy_bins), dtype=np.int64)
+        chunk = (n + nt - 1) // nt
+        for t in numba.prange(nt):
+            for k in range(t * chunk, min(t * chunk + chunk, n)):
+                x = points[k, 0]
+                y = points[k, 1]
+                z = points[k, 2]
+
+                iz = int((z - z_min) * z_scale)
+                if iz < 0:
+                    iz = 0
+                elif iz >= z_bins:
+                    iz = z_bins - 1
+                z_hist[t, iz] += 1
+
+                icx = int((x - cx_min) * cx_scale)
+                if icx < 0:
+                    icx = 0
+                elif icx >= cx_bins:
+                    icx = cx_bins - 1
+                icy = int((y - cy_min) * cy_scale)
+                if icy < 0:
+                    icy = 0
+                elif icy >= cy_bins:
+                    icy = cy_bins - 1
+                c_hist[t, icx * cy_bins + icy] += 1
+
+                if z > z_threshold:
+                    iwx = int((x - wx_min) * wx_scale)
+                    if iwx < 0:
+                        iwx = 0
+                    elif iwx >= wx_bins:
+                        iwx = wx_bins - 1
+                    iwy = int((y - wy_min) * wy_scale)
+                    if iwy < 0:
+                        iwy = 0
+                    elif iwy >= wy_bins:
+                        iwy = wy_bins - 1
+                    w_hist[t, iwx * wy_bins + iwy] += 1
+        return z_hist.sum(axis=0), w_hist.sum(axis=0), c_hist.sum(axis=0)
+
+
+def _fused_histograms(points: np.ndarray, z_bounds: Tuple[float, float],
+                      z_step: float = 0.05, wall_grid: float = 0.1,
+                      col_grid: float = 0.5):
+    """
+    Гистограммы для всех трёх детекторов одним проходом (только с Numba).
+    Сетки строятся так же, как в самих детекторах, поэтому результаты
+    идентичны раздельному вычислению. None - фьюжн неприменим,
+    детекторы считают гистограммы сами
+    """
+    if not HAS_NUMBA:
+        return None
+
+    z_min, z_max = z_bounds
+    z_bins = int((z_max - z_min) / z_step)
+    if z_bins <= 0:
+        return None
+
+    z_threshold = z_min + (z_max - z_min) * 0.5
+    wx_min, wx_max, wy_min, wy_max = _wall_bounds_kernel(points, z_threshold)
+    if not np.isfinite(wx_min):
+        return None
+
+    # Сетка стен - как в detect_walls
+    wx_bins = int((wx_max - wx_min) / wall_grid) + 1
+    wy_bins = int((wy_max - wy_min) / wall_grid) + 1
+
+    # Сетка колонн - как в detect_columns (с потолком 200)
+    cx_min, cx_max = points[:, 0].min(), points[:, 0].max()
+    cy_min, cy_max = points[:, 1].min(), points[:, 1].max()
+    cx_bins = min(int((cx_max - cx_min) / col_grid) + 1, 200)
+    cy_bins = min(int((cy_max - cy_min) / col_grid) + 1, 200)
+
+    def _scale(bins, lo, hi):
+        return bins / (hi - lo) if hi > lo else 0.0
+
+    z_hist, w_flat, c_flat = _fused_histograms_kernel(
+        points,
+        z_min, _scale(z_bins, z_min, z_max), z_bins, z_threshold,
+        wx_min, _scale(wx_bins, wx_min, wx_max), wx_bins,
+        wy_min, _scale(wy_bins, wy_min, wy_max), wy_bins,
+        cx_min, _scale(cx_bins, cx_min, cx_max), cx_bins,
+        cy_min, _scale(cy_bins, cy_min, cy_max), cy_bins
+    )
+
+    return {
+        'slabs': (z_hist, np.linspace(z_min, z_max, z_bins + 1)),
+        'walls': (
+            w_flat.reshape(wx_bins, wy_bins).astype(np.float64),
+            np.linspace(wx_min, wx_max, wx_bins + 1),
+            np.linspace(wy_min, wy_max, wy_bins + 1)
+        ),
+        'columns': (
+            c_flat.reshape(cx_bins, cy_bins).astype(np.float64),
+            np.linspace(cx_min, cx_max, cx_bins + 1),
+            np.linspace(cy_min, cy_max, cy_bins + 1)
+        )
+    }
+
+
+def _histogram2d(x: np.ndarray, y: np.ndarray,
+                 x_range: Tuple[float, float], y_range: Tuple[float, float],
+                 bins: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    2D-гистограмма с равномерными бинами: bincount по линеаризованным
+    индексам ячеек - один проход без бинарного поиска границ бинов.
+    Возвращает (hist, x_edges, y_edges) как np.histogram2d
+    """
+    x_bins, y_bins = bins
+    x_scale = x_bins / (x_range[1] - x_range[0]) if x_range[1] > x_range[0] else 0.0
+    y_scale = y_bins / (y_range[1] - y_range[0]) if y_range[1] > y_range[0] else 0.0
+
+    ix = ((x - x_range[0]) * x_scale).astype(np.int32)
+    iy = ((y - y_range[0]) * y_scale).astype(np.int32)
+    np.clip(ix, 0, x_bins - 1, out=ix)
+    np.clip(iy, 0, y_bins - 1, out=iy)
+
+    flat = ix * np.int32(y_bins) + iy
+    hist = np.bincount(flat, minlength=x_bins * y_bins).astype(np.float64)
+    hist = hist.reshape(x_bins, y_bins)
+
+    x_edges = np.linspace(x_range[0], x_range[1], x_bins + 1)
+    y_edges = np.linspace(y_range[0], y_range[1], y_bins + 1)
+    return hist, x_edges, y_edges
+
+def detect_slabs(points: np.ndarray, z_step: float = 0.05,
+                 z_bounds: Tuple[float, float] = None,
+                 hist_data: tuple = None) -> List[Dict[str, Any]]:
     """
     Определение горизонтальных плит через анализ гистограммы высот
     Основано на методе из Cloud2BIM
     """
     print("Определение плит (slabs)...")
-    
-    points = np.asarray(point_cloud.points)
-    z_coords = points[:, 2]  # Z координаты
-    
-    # Создаем гистограмму по высоте
-    z_min, z_max = z_coords.min(), z_coords.max()
-    bins = int((z_max - z_min) / z_step)
-    hist, bin_edges = np.histogram(z_coords, bins=bins)
-    
-    # Находим пики в гистограмме (потенциальные плиты)
+
+    if hist_data is not None:
+        # Гистограмма уже посчитана фьюжн-кернелом
+        hist, bin_edges = hist_data
+    else:
+        z_coords = points[:, 2]  # Z координаты
+
+        # Гистограмма по высоте через bincount: квантуем Z в целые индексы
+        # и считаем одним проходом, без сравнений с границами бинов в np.histogram
+        z_min, z_max = z_bounds if z_bounds is not None else (z_coords.min(), z_coords.max())
+        bins = int((z_max - z_min) / z_step)
+        idx = ((z_coords - z_min) * (bins / (z_max - z_min))).astype(np.int32)
+        np.clip(idx, 0, bins - 1, out=idx)
+        hist = np.bincount(idx, minlength=bins)
+        bin_edges = np.linspace(z_min, z_max, bins + 1)
+
+    # Находим пики в гистограмме (потенциальные плиты): центры считаем
+    # только для бинов выше порога, а не для всей гистограммы
     threshold = np.max(hist) * 0.3  # 30% от максимума
-    slab_candidates = []
-    
-    for i in range(len(hist)):
-        if hist[i] > threshold:
-            z_level = (bin_edges[i] + bin_edges[i+1]) / 2
-            slab_candidates.append({
-                'z': z_level,
-                'density': hist[i]
-            })
-    
-    # Группируем близкие пики (в пределах 0.3м считаем одной плитой)
+    above = np.flatnonzero(hist > threshold)
+    peak_z = 0.5 * (bin_edges[above] + bin_edges[above + 1])
+
+    # Группируем близкие пики (в пределах 0.3м считаем одной плитой):
+    # режем отсортированные центры по разрывам >= 0.3м и усредняем группы
     slabs = []
-    if len(slab_candidates) > 0:
-        current_slab = [slab_candidates[0]]
-        
-        for candidate in slab_candidates[1:]:
-            if candidate['z'] - current_slab[-1]['z'] < 0.3:
-                current_slab.append(candidate)
-            else:
-                # Завершаем текущую плиту
-                avg_z = np.mean([s['z'] for s in current_slab])
-                slabs.append({
-                    'type': 'IfcSlab',
-                    'z': float(avg_z),
-                    'thickness': 0.3  # Стандартная толщина для MVP
-                })
-                current_slab = [candidate]
-        
-        # Добавляем последнюю плиту
-        if len(current_slab) > 0:
-            avg_z = np.mean([s['z'] for s in current_slab])
-            slabs.append({
+    if peak_z.size > 0:
+        gaps = np.flatnonzero(np.diff(peak_z) >= 0.3) + 1
+        groups = np.split(peak_z, gaps)
+        slabs = [
+            {
                 'type': 'IfcSlab',
-                'z': float(avg_z),
-                'thickness': 0.3
-            })
-    
+                # numpy-скаляры сериализует model_store (OPT_SERIALIZE_NUMPY),
+                # float()-касты на каждый элемент больше не нужны
+                'z': group.mean(),
+                'thickness': 0.3  # Стандартная толщина для MVP
+            }
+            for group in groups if group.size > 0
+        ]
+
     print(f"Найдено плит: {len(slabs)}")
     return slabs
 
-def detect_walls(point_cloud: o3d.geometry.PointCloud, grid_size: float = 0.1) -> List[Dict[str, Any]]:
+def detect_walls(points: np.ndarray, grid_size: float = 0.1,
+                 z_bounds: Tuple[float, float] = None,
+                 hist_data: tuple = None) -> List[Dict[str, Any]]:
     """
     Определение вертикальных стен через 2D гистограмму
     Упрощенная версия метода из Cloud2BIM
     """
     print("Определение стен (walls)...")
-    
-    points = np.asarray(point_cloud.points)
-    
+
     # Берем только точки в средней части по высоте (90-100% высоты этажа)
-    z_coords = points[:, 2]
-    z_min, z_max = z_coords.min(), z_coords.max()
-    z_range = z_max - z_min
-    z_threshold = z_min + z_range * 0.5  # Берем верхние 50%
-    
-    wall_points = points[z_coords > z_threshold]
-    
-    if len(wall_points) == 0:
-        return []
-    
-    # Проекция на плоскость XY
-    xy_points = wall_points[:, :2]
-    
-    # Создаем 2D гистограмму
-    x_min, x_max = xy_points[:, 0].min(), xy_points[:, 0].max()
-    y_min, y_max = xy_points[:, 1].min(), xy_points[:, 1].max()
-    
-    x_bins = int((x_max - x_min) / grid_size) + 1
-    y_bins = int((y_max - y_min) / grid_size) + 1
-    
-    hist_2d, x_edges, y_edges = np.histogram2d(
-        xy_points[:, 0], 
-        xy_points[:, 1], 
-        bins=[x_bins, y_bins]
-    )
-    
+    if z_bounds is not None:
+        z_min, z_max = z_bounds
+    else:
+        z_coords = points[:, 2]
+        z_min, z_max = z_coords.min(), z_coords.max()
+
+    if hist_data is not None:
+        # Гистограмма уже посчитана фьюжн-кернелом
+        hist_2d, x_edges, y_edges = hist_data
+    else:
+        z_range = z_max - z_min
+        z_threshold = z_min + z_range * 0.5  # Берем верхние 50%
+
+        # Материализуем только нужные столбцы: np.compress по X и Y вместо
+        # булева индексирования всей (N, 3) матрицы - на треть меньше копий
+        mask = points[:, 2] > z_threshold
+        wall_x = np.compress(mask, points[:, 0])
+        wall_y = np.compress(mask, points[:, 1])
+
+        if len(wall_x) == 0:
+            return []
+
+        # Создаем 2D гистограмму
+        x_min, x_max = wall_x.min(), wall_x.max()
+        y_min, y_max = wall_y.min(), wall_y.max()
+
+        x_bins = int((x_max - x_min) / grid_size) + 1
+        y_bins = int((y_max - y_min) / grid_size) + 1
+
+        hist_2d, x_edges, y_edges = _histogram2d(
+            wall_x,
+            wall_y,
+            (x_min, x_max), (y_min, y_max),
+            bins=[x_bins, y_bins]
+        )
+
     # Находим области с высокой плотностью (стены)
     threshold = np.max(hist_2d) * 0.2  # 20% от максимума
     wall_mask = hist_2d > threshold
-    
-    # Простое определение стен (для MVP)
-    walls = []
+
     wall_height = z_max - z_min
-    
-    # Ищем вертикальные линии (стены вдоль X)
-    for j in range(y_bins):
-        wall_segments = []
-        for i in range(x_bins):
-            if wall_mask[i, j]:
-                x_center = (x_edges[i] + x_edges[i+1]) / 2
-                y_center = (y_edges[j] + y_edges[j+1]) / 2
-                wall_segments.append([x_center, y_center])
-        
-        if len(wall_segments) > 5:  # Минимум 5 точек для стены
-            segments_array = np.array(wall_segments)
-            walls.append({
-                'type': 'IfcWall',
-                'start': [float(segments_array[0, 0]), float(segments_array[0, 1]), float(z_min)],
-                'end': [float(segments_array[-1, 0]), float(segments_array[-1, 1]), float(z_min)],
-                'height': float(wall_height),
-                'thickness': 0.2  # Стандартная толщина 20см
-            })
-    
-    # Ищем горизонтальные линии (стены вдоль Y)
-    for i in range(x_bins):
-        wall_segments = []
-        for j in range(y_bins):
-            if wall_mask[i, j]:
-                x_center = (x_edges[i] + x_edges[i+1]) / 2
-                y_center = (y_edges[j] + y_edges[j+1]) / 2
-                wall_segments.append([x_center, y_center])
-        
-        if len(wall_segments) > 5:
-            segments_array = np.array(wall_segments)
-            walls.append({
-                'type': 'IfcWall',
-                'start': [float(segments_array[0, 0]), float(segments_array[0, 1]), float(z_min)],
-                'end': [float(segments_array[-1, 0]), float(segments_array[-1, 1]), float(z_min)],
-                'height': float(wall_height),
-                'thickness': 0.2
-            })
-    
+
+    # Скан сетки выполняет JIT-кернел (или его Python-fallback),
+    # здесь только форматируем найденные линии в словари
+    x_centers = 0.5 * (x_edges[:-1] + x_edges[1:])
+    y_centers = 0.5 * (y_edges[:-1] + y_edges[1:])
+    runs = _extract_wall_runs(wall_mask, x_centers, y_centers, MIN_WALL_CELLS)
+
+    walls = [
+        {
+            'type': 'IfcWall',
+            'start': [run[0], run[1], z_min],
+            'end': [run[2], run[3], z_min],
+            'height': wall_height,
+            'thickness': 0.2  # Стандартная толщина 20см
+        }
+        for run in runs
+    ]
+
     print(f"Найдено стен: {len(walls)}")
     return walls
 
-def detect_columns(point_cloud: o3d.geometry.PointCloud, grid_size: float = 0.5) -> List[Dict[str, Any]]:
+def detect_columns(points: np.ndarray, grid_size: float = 0.5,
+                   z_bounds: Tuple[float, float] = None,
+                   hist_data: tuple = None) -> List[Dict[str, Any]]:
     """
     Упрощенное определение колонн через 2D гистограмму (без DBSCAN)
     Для MVP - быстрый метод без больших затрат памяти
     """
     print("Определение колонн (columns)...")
-    
-    points = np.asarray(point_cloud.points)
-    
-    z_coords = points[:, 2]
-    z_min, z_max = z_coords.min(), z_coords.max()
+
+    if z_bounds is not None:
+        z_min, z_max = z_bounds
+    else:
+        z_coords = points[:, 2]
+        z_min, z_max = z_coords.min(), z_coords.max()
     height_range = z_max - z_min
-    
+
     # Если высота меньше 2м, колонн нет
     if height_range < 2.0:
         print("Высота помещения слишком мала для определения колонн")
         return []
+
+    if hist_data is not None:
+        # Гистограмма уже посчитана фьюжн-кернелом
+        hist_2d, x_edges, y_edges = hist_data
+    else:
+        # Используем 2D гистограмму на XY плоскости
+        xy_points = points[:, :2]
+
+        x_min, x_max = xy_points[:, 0].min(), xy_points[:, 0].max()
+        y_min, y_max = xy_points[:, 1].min(), xy_points[:, 1].max()
+
+        x_bins = int((x_max - x_min) / grid_size) + 1
+        y_bins = int((y_max - y_min) / grid_size) + 1
+
+        # Ограничиваем размер гистограммы
+        x_bins = min(x_bins, 200)
+        y_bins = min(y_bins, 200)
+
+        hist_2d, x_edges, y_edges = _histogram2d(
+            xy_points[:, 0],
+            xy_points[:, 1],
+            (x_min, x_max), (y_min, y_max),
+            bins=[x_bins, y_bins]
+        )
     
-    # Используем 2D гистограмму на XY плоскости
-    xy_points = points[:, :2]
-    
-    x_min, x_max = xy_points[:, 0].min(), xy_points[:, 0].max()
-    y_min, y_max = xy_points[:, 1].min(), xy_points[:, 1].max()
-    
-    x_bins = int((x_max - x_min) / grid_size) + 1
-    y_bins = int((y_max - y_min) / grid_size) + 1
-    
-    # Ограничиваем размер гистограммы
-    x_bins = min(x_bins, 200)
-    y_bins = min(y_bins, 200)
-    
-    hist_2d, x_edges, y_edges = np.histogram2d(
-        xy_points[:, 0], 
-        xy_points[:, 1], 
-        bins=[x_bins, y_bins]
-    )
-    
-    # Находим локальные максимумы (потенциальные колонны)
+    # Находим локальные максимумы (потенциальные колонны) одним
+    # вызовом maximum_filter вместо Python-цикла по ячейкам
     threshold = np.max(hist_2d) * 0.6  # 60% от максимума
-    
-    columns = []
-    
-    for i in range(1, x_bins - 1):
-        for j in range(1, y_bins - 1):
-            # Проверяем, что это локальный максимум
-            if hist_2d[i, j] > threshold:
-                # Проверяем соседние клетки
-                neighbors = hist_2d[i-1:i+2, j-1:j+2]
-                if hist_2d[i, j] == np.max(neighbors):
-                    x_center = (x_edges[i] + x_edges[i+1]) / 2
-                    y_center = (y_edges[j] + y_edges[j+1]) / 2
-                    
-                    columns.append({
-                        'type': 'IfcColumn',
-                        'position': [float(x_center), float(y_center), float(z_min)],
-                        'height': float(height_range),
-                        'width': 0.4,  # Стандартная ширина 40см
-                        'depth': 0.4
-                    })
+
+    local_max = maximum_filter(hist_2d, size=3, mode='constant')
+    peaks = (hist_2d == local_max) & (hist_2d > threshold)
+    # Граничные ячейки не рассматриваем (как и раньше)
+    peaks[0, :] = peaks[-1, :] = False
+    peaks[:, 0] = peaks[:, -1] = False
+
+    # Таблицы центров бинов считаем один раз на функцию,
+    # дальше только индексируем
+    x_centers = 0.5 * (x_edges[:-1] + x_edges[1:])
+    y_centers = 0.5 * (y_edges[:-1] + y_edges[1:])
+
+    ii, jj = np.nonzero(peaks)
+
+    columns = [
+        {
+            'type': 'IfcColumn',
+            'position': [x_center, y_center, z_min],
+            'height': height_range,
+            'width': 0.4,  # Стандартная ширина 40см
+            'depth': 0.4
+        }
+        for x_center, y_center in zip(x_centers[ii], y_centers[jj])
+    ]
     
     # Ограничиваем количество колонн (для MVP)
     if len(columns) > 50:
@@ -215,14 +522,12 @@ def detect_columns(point_cloud: o3d.geometry.PointCloud, grid_size: float = 0.5)
     print(f"Найдено колонн: {len(columns)}")
     return columns
 
-def segment_by_storeys(point_cloud: o3d.geometry.PointCloud, slabs: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+def segment_by_storeys(points: np.ndarray, slabs: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
     """
     Разделение облака точек по этажам на основе плит
     """
     print("\nРазделение по этажам...")
-    
-    points = np.asarray(point_cloud.points)
-    
+
     # Сортируем плиты по высоте
     sorted_slabs = sorted(slabs, key=lambda s: s['z'])
     
@@ -247,16 +552,12 @@ def segment_by_storeys(point_cloud: o3d.geometry.PointCloud, slabs: List[Dict[st
         
         if len(storey_points) < 1000:  # Минимум точек для этажа
             continue
-        
-        # Создаем облако точек для этажа
-        storey_cloud = o3d.geometry.PointCloud()
-        storey_cloud.points = o3d.utility.Vector3dVector(storey_points)
-        
+
         storeys[i] = {
             'floor_z': z_min,
             'ceiling_z': z_max,
             'height': storey_height,
-            'point_cloud': storey_cloud,
+            'points': storey_points,
             'floor_slab': floor_slab,
             'ceiling_slab': ceiling_slab
         }
@@ -274,7 +575,31 @@ class PointCloudProcessor:
         self.e57_path = f"uploads/{task_id}.e57"
         self.point_cloud = None
         self.downsampled_cloud = None
-        
+        # float32-копия точек для детекторов: вдвое меньше трафика памяти
+        # на гистограммах (Open3D внутри требует float64)
+        self.points_f32 = None
+        # Tensor API облако (CUDA при наличии GPU); None - легаси CPU путь
+        self.tpcd = None
+        self.downsampled_tpcd = None
+
+    def _make_tensor_cloud(self, points: np.ndarray):
+        """
+        Облако точек через Tensor API на CUDA (если доступна) или CPU.
+        None - Tensor API недоступен, работаем через легаси-геометрию
+        """
+        try:
+            import open3d.core as o3c
+            if o3c.cuda.is_available():
+                device = o3c.Device("CUDA:0")
+            else:
+                device = o3c.Device("CPU:0")
+            tensor = o3c.Tensor(points, dtype=o3c.float32, device=device)
+            print(f"Tensor API: устройство {device}")
+            return o3d.t.geometry.PointCloud(tensor)
+        except Exception as e:
+            print(f"Tensor API недоступен ({e}), используем legacy-обработку")
+            return None
+
     def load_e57(self) -> bool:
         """
         Загрузка E57 файла
@@ -285,19 +610,56 @@ class PointCloudProcessor:
             # Читаем E57
             e57 = pye57.E57(self.e57_path)
             
-            # Получаем данные первого скана
-            data = e57.read_scan(0, colors=False, ignore_missing_fields=True)
-            
-            # Извлекаем координаты
-            points = np.column_stack((data['cartesianX'], 
-                                     data['cartesianY'], 
-                                     data['cartesianZ']))
-            
-            # Создаем облако точек Open3D
-            self.point_cloud = o3d.geometry.PointCloud()
-            self.point_cloud.points = o3d.utility.Vector3dVector(points)
+            # Читаем сырые массивы скана в предвыделенный float32-буфер:
+            # присваивание по столбцам кастует на месте, без промежуточных
+            # копий от read_scan + np.stack
+            header = e57.get_header(0)
+            # Маска невалидных точек и поза ниже могут заменить points
+            # производной копией - буфер из пула держим отдельной ссылкой
+            points = scan_buf = _get_buf(header.point_count)
+            raw = e57.read_scan_raw(0)
+            points[:, 0] = raw['cartesianX']
+            points[:, 1] = raw['cartesianY']
+            points[:, 2] = raw['cartesianZ']
+            invalid_state = raw.get('cartesianInvalidState')
+            # Сразу отпускаем float64-буферы pye57
+            del raw
+
+            # read_scan_raw, в отличие от read_scan, не применяет позу
+            # скана и не отбрасывает невалидные точки - повторяем оба
+            # шага векторно
+            if invalid_state is not None:
+                valid = np.asarray(invalid_state) == 0
+                if not valid.all():
+                    points = points[valid]
+
+            try:
+                rotation = header.rotation_matrix.astype(np.float32)
+                translation = header.translation.astype(np.float32)
+                has_pose = (not np.allclose(rotation, np.eye(3))
+                            or translation.any())
+            except Exception:
+                # У скана нет позы - точки уже в мировых координатах
+                has_pose = False
+            if has_pose:
+                points = points @ rotation.T
+                points += translation
+
+            # Пробуем Tensor API (CUDA outlier removal / downsample ~10-20x
+            # быстрее легаси); иначе - легаси облако из float64
+            self.tpcd = self._make_tensor_cloud(points)
+            if self.tpcd is None:
+                self.point_cloud = o3d.geometry.PointCloud()
+                self.point_cloud.points = o3d.utility.Vector3dVector(
+                    points.astype(np.float64)
+                )
             
-            print(f"Загружено точек: {len(points)}")
+            # Облако уже скопировало координаты - возвращаем в пул
+            # исходный буфер, а не производную копию
+            count = len(points)
+            _release_buf(scan_buf)
+
+            print(f"Загружено точек: {count}")
             return True
             
         except Exception as e:
@@ -309,15 +671,50 @@ class PointCloudProcessor:
         Фильтрация шумов
         """
         print("Фильтрация шумов...")
-        
+
         # Statistical outlier removal
-        cl, ind = self.point_cloud.remove_statistical_outlier(
-            nb_neighbors=20,
-            std_ratio=2.0
-        )
-        self.point_cloud = self.point_cloud.select_by_index(ind)
-        
-        print(f"После фильтрации: {len(self.point_cloud.points)} точек")
+        if self.tpcd is not None:
+            self.tpcd, _ = self.tpcd.remove_statistical_outliers(
+                nb_neighbors=20,
+                std_ratio=2.0
+            )
+            count = len(self.tpcd.point.positions)
+        else:
+            # Аналог removeNaNFromPointCloud из PCL: выкидываем нефинитные
+            # точки одним проходом, чтобы kNN не проверял их поштучно
+            self.point_cloud.remove_non_finite_points()
+
+            # Легаси remove_statistical_outlier однопоточен; делим облако
+            # на 8 октантов вокруг центроида и фильтруем их параллельно
+            # (Open3D отпускает GIL в C++). Семантика меняется только у
+            # точек на границах октантов
+            points = np.asarray(self.point_cloud.points)
+            octant_idx = np.packbits(
+                np.signbit(points - points.mean(axis=0)),
+                axis=1, bitorder='little'
+            ).ravel()
+
+            def _filter_octant(octant: int) -> np.ndarray:
+                octant_points = points[octant_idx == octant]
+                if len(octant_points) == 0:
+                    return octant_points
+                sub = o3d.geometry.PointCloud()
+                sub.points = o3d.utility.Vector3dVector(octant_points)
+                cl, _ = sub.remove_statistical_outlier(
+                    nb_neighbors=20,
+                    std_ratio=2.0
+                )
+                return np.asarray(cl.points)
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                filtered = list(pool.map(_filter_octant, range(8)))
+
+            self.point_cloud.points = o3d.utility.Vector3dVector(
+                np.concatenate(filtered)
+            )
+            count = len(self.point_cloud.points)
+
+        print(f"После фильтрации: {count} точек")
     
     def downsample(self, voxel_size: float = 0.05):
         """
@@ -325,9 +722,32 @@ class PointCloudProcessor:
         voxel_size: размер вокселя в метрах (0.05м = 5см)
         """
         print(f"Downsampling с voxel_size={voxel_size}...")
-        
-        self.downsampled_cloud = self.point_cloud.voxel_down_sample(voxel_size)
-        
+
+        # На гигантских сканах (100М+ точек) сначала дешёвая случайная
+        # выборка 1/4: избыточность скана такова, что после вокселизации
+        # итоговая плотность практически не меняется, а пик памяти
+        # хеш-сетки падает кратно
+        if self.tpcd is not None:
+            n = len(self.tpcd.point.positions)
+            if n > DOWNSAMPLE_PREFILTER_POINTS:
+                import open3d.core as o3c
+                print(f"Прореживание перед downsampling: {n} точек")
+                idx = np.random.default_rng(0).integers(0, n, size=n // 4)
+                self.tpcd = self.tpcd.select_by_index(o3c.Tensor(idx))
+            self.downsampled_tpcd = self.tpcd.voxel_down_sample(voxel_size)
+            # Легаси-копия для сохранения PLY и bounds модели
+            self.downsampled_cloud = self.downsampled_tpcd.to_legacy()
+        else:
+            n = len(self.point_cloud.points)
+            if n > DOWNSAMPLE_PREFILTER_POINTS:
+                print(f"Прореживание перед downsampling: {n} точек")
+                idx = np.random.default_rng(0).integers(0, n, size=n // 4)
+                self.point_cloud = self.point_cloud.select_by_index(idx)
+            self.downsampled_cloud = self.point_cloud.voxel_down_sample(voxel_size)
+
+        # Обновляем float32-буфер: детекторы работают с ним напрямую
+        self.points_f32 = np.asarray(self.downsampled_cloud.points).astype(np.float32)
+
         print(f"После downsampling: {len(self.downsampled_cloud.points)} точек")
         
     def save_processed_cloud(self):
@@ -335,7 +755,20 @@ class PointCloudProcessor:
         Сохранение обработанного облака в формате PLY
         """
         output_path = f"processed/{self.task_id}.ply"
-        o3d.io.write_point_cloud(output_path, self.downsampled_cloud)
+        # Бинарный PLY через tensor API: запись идёт напрямую из
+        # float32-буфера, минуя Python-обёртку Vector3dVector
+        try:
+            tpcd = self.downsampled_tpcd
+            if tpcd is None:
+                tpcd = o3d.t.geometry.PointCloud.from_legacy(
+                    self.downsampled_cloud
+                )
+            o3d.t.io.write_point_cloud(
+                output_path, tpcd, write_ascii=False, compressed=False
+            )
+        except Exception as e:
+            print(f"Tensor-запись PLY недоступна ({e}), пишем через legacy")
+            o3d.io.write_point_cloud(output_path, self.downsampled_cloud)
         print(f"Облако сохранено: {output_path}")
         return output_path
     
@@ -344,55 +777,89 @@ class PointCloudProcessor:
         Сегментация элементов здания с разделением по этажам
         """
         print("\n=== Начало сегментации ===")
-        
-        cloud = self.downsampled_cloud
-        
-        # 1. Определяем плиты (все этажи)
-        all_slabs = detect_slabs(cloud)
-        
+
+        points = self.points_f32
+
+        # Границы по Z считаем один раз и передаём во все детекторы,
+        # чтобы не гонять три редукции по всему облаку
+        z_coords = points[:, 2]
+        z_bounds = (float(z_coords.min()), float(z_coords.max()))
+
+        # При наличии Numba все три гистограммы сегментации считаются
+        # одним фьюжн-проходом по облаку; детекторам остаётся только
+        # извлечение пиков. Иначе каждый детектор строит гистограмму сам
+        fused = _fused_histograms(points, z_bounds)
+        hists = fused if fused is not None else {
+            'slabs': None, 'walls': None, 'columns': None
+        }
+
+        # 1. Сначала плиты: от их числа зависит, нужны ли вообще
+        # детекторы стен/колонн по всему зданию
+        all_slabs = detect_slabs(points, z_bounds=z_bounds,
+                                 hist_data=hists['slabs'])
+
         if len(all_slabs) < 2:
             print("Недостаточно плит для разделения на этажи, обрабатываем как один этаж")
-            # Обрабатываем всё здание как один этаж
-            walls = detect_walls(cloud)
-            columns = detect_columns(cloud)
-            
-            return {
-                'slabs': all_slabs,
-                'walls': walls,
-                'columns': columns,
-                'storeys': []
-            }
+            # Обрабатываем всё здание как один этаж; стены и колонны
+            # не зависят друг от друга и читают общий массив points,
+            # а numpy/scipy отпускают GIL - считаем их параллельно
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                walls_future = pool.submit(detect_walls, points,
+                                           z_bounds=z_bounds,
+                                           hist_data=hists['walls'])
+                columns_future = pool.submit(detect_columns, points,
+                                             z_bounds=z_bounds,
+                                             hist_data=hists['columns'])
+                return {
+                    'slabs': all_slabs,
+                    'walls': walls_future.result(),
+                    'columns': columns_future.result(),
+                    'storeys': []
+                }
         
         # 2. Разделяем на этажи
-        storeys_data = segment_by_storeys(cloud, all_slabs)
+        storeys_data = segment_by_storeys(points, all_slabs)
         
-        # 3. Обрабатываем каждый этаж отдельно
+        # 3. Обрабатываем каждый этаж отдельно: пары стены/колонны всех
+        # этажей считаются в одном пуле потоков
         all_walls = []
         all_columns = []
         storeys_info = []
-        
-        for storey_idx, storey in storeys_data.items():
-            print(f"\n--- Обработка этажа {storey_idx} ---")
-            
-            # Сегментация стен для этажа
-            walls = detect_walls(storey['point_cloud'])
-            
+
+        with ThreadPoolExecutor() as pool:
+            storey_futures = {}
+            for storey_idx, storey in storeys_data.items():
+                # Одна пара редукций по точкам этажа на оба детектора
+                storey_z = storey['points'][:, 2]
+                storey_z_bounds = (float(storey_z.min()), float(storey_z.max()))
+                storey_futures[storey_idx] = (
+                    pool.submit(detect_walls, storey['points'],
+                                z_bounds=storey_z_bounds),
+                    pool.submit(detect_columns, storey['points'],
+                                z_bounds=storey_z_bounds)
+                )
+
+            results = {
+                idx: (walls_f.result(), columns_f.result())
+                for idx, (walls_f, columns_f) in storey_futures.items()
+            }
+
+        for storey_idx, (walls, columns) in results.items():
+            storey = storeys_data[storey_idx]
+
             # Корректируем высоту стен
             for wall in walls:
                 wall['height'] = storey['height']
                 wall['storey'] = storey_idx
-            
-            # Сегментация колонн для этажа
-            columns = detect_columns(storey['point_cloud'])
-            
+
             # Корректируем высоту колонн
             for column in columns:
                 column['height'] = storey['height']
                 column['storey'] = storey_idx
-            
+
             all_walls.extend(walls)
             all_columns.extend(columns)
-            
+
             storeys_info.append({
                 'index': storey_idx,
                 'floor_z': storey['floor_z'],
@@ -413,7 +880,7 @@ class PointCloudProcessor:
     
     def save_model_data(self, elements: Dict[str, List[Dict[str, Any]]]):
         """
-        Сохранение данных модели в JSON
+        Сохранение данных модели в хранилище
         """
         model_data = {
             'task_id': self.task_id,
@@ -426,10 +893,8 @@ class PointCloudProcessor:
             }
         }
         
-        output_path = f"models/{self.task_id}.json"
-        with open(output_path, 'w') as f:
-            json.dump(model_data, f, indent=2)
-        
+        output_path = model_store.save_model(self.task_id, model_data)
+
         print(f"Модель сохранена: {output_path}")
         return output_path
 
@@ -0,0 +1,215 @@
+import math
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List
+
+"""
+Быстрый экспорт IFC4: STEP-текст собирается напрямую f-строками, без
+создания сущностей через ifcopenshell (один вызов C++ на элемент - дорого
+при тысячах элементов). Геометрия MVP фиксированная (прямоугольный профиль
++ экструзия), поэтому шаблонный вывод эквивалентен API-пути.
+
+Путь включается переменной окружения E57IFC_FAST_STEP=1; по умолчанию
+остаётся проверенный API-путь в ifc_generator.
+"""
+
+# Минимальная длина стены (м) - как в ifc_generator
+MIN_WALL_LENGTH = 0.1
+
+# Алфавит base64-кодировки IFC GlobalId
+_GUID_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_$"
+
+
+def enabled() -> bool:
+    """
+    Включен ли быстрый STEP-путь (переменная окружения E57IFC_FAST_STEP)
+    """
+    return os.environ.get("E57IFC_FAST_STEP") == "1"
+
+
+def _new_guid() -> str:
+    """
+    Сжатый 22-символьный IFC GlobalId из случайного UUID
+    """
+    n = uuid.uuid4().int
+    chars = []
+    for _ in range(22):
+        n, rem = divmod(n, 64)
+        chars.append(_GUID_CHARS[rem])
+    return "".join(reversed(chars))
+
+
+def _f(value: float) -> str:
+    """
+    Число в формате STEP: обязательно с десятичной точкой
+    """
+    s = f"{float(value):.10g}"
+    if "." not in s and "e" not in s and "E" not in s:
+        s += "."
+    return s
+
+
+class _StepBuilder:
+    """
+    Накопитель STEP-строк с монотонным счётчиком номеров сущностей
+    """
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.next_id = 1
+
+    def add(self, body: str) -> int:
+        eid = self.next_id
+        self.next_id += 1
+        self.lines.append(f"#{eid}={body};")
+        return eid
+
+
+def write_step(model_data: Dict[str, Any], output_path: str):
+    """
+    Сборка и запись полного IFC4 STEP-файла из данных модели
+    """
+    b = _StepBuilder()
+    elements = model_data['elements']
+    bounds = model_data['bounds']
+
+    # --- общие сущности ---
+    origin = b.add("IFCCARTESIANPOINT((0.,0.,0.))")
+    zdir = b.add("IFCDIRECTION((0.,0.,1.))")
+    xdir = b.add("IFCDIRECTION((1.,0.,0.))")
+    origin_placement = b.add(f"IFCAXIS2PLACEMENT3D(#{origin},#{zdir},#{xdir})")
+
+    # --- единицы и контексты ---
+    length_unit = b.add("IFCSIUNIT(*,.LENGTHUNIT.,$,.METRE.)")
+    units = b.add(f"IFCUNITASSIGNMENT((#{length_unit}))")
+    wcs = b.add(f"IFCAXIS2PLACEMENT3D(#{origin},$,$)")
+    ctx = b.add(f"IFCGEOMETRICREPRESENTATIONCONTEXT($,'Model',3,1.E-05,#{wcs},$)")
+    body_ctx = b.add(
+        f"IFCGEOMETRICREPRESENTATIONSUBCONTEXT('Body','Model',*,*,*,*,#{ctx},$,.MODEL_VIEW.,$)"
+    )
+
+    # --- пространственная структура ---
+    project = b.add(
+        f"IFCPROJECT('{_new_guid()}',$,'E57 to IFC Conversion',$,$,$,$,(#{ctx}),#{units})"
+    )
+    site_lp = b.add(f"IFCLOCALPLACEMENT($,#{origin_placement})")
+    site = b.add(
+        f"IFCSITE('{_new_guid()}',$,'Site',$,$,#{site_lp},$,$,.ELEMENT.,$,$,$,$,$)"
+    )
+    building_lp = b.add(f"IFCLOCALPLACEMENT(#{site_lp},#{origin_placement})")
+    building = b.add(
+        f"IFCBUILDING('{_new_guid()}',$,'Building',$,$,#{building_lp},$,$,.ELEMENT.,$,$,$)"
+    )
+    b.add(f"IFCRELAGGREGATES('{_new_guid()}',$,$,$,#{project},(#{site}))")
+    b.add(f"IFCRELAGGREGATES('{_new_guid()}',$,$,$,#{site},(#{building}))")
+
+    storeys_count = len(model_data.get('storeys', [])) or 1
+    storeys = {}
+    for i in range(storeys_count):
+        storey_lp = b.add(f"IFCLOCALPLACEMENT(#{building_lp},#{origin_placement})")
+        name = f"Floor {i}" if storeys_count > 1 else "Ground Floor"
+        storeys[i] = b.add(
+            f"IFCBUILDINGSTOREY('{_new_guid()}',$,'{name}',$,$,#{storey_lp},$,$,.ELEMENT.,$)"
+        )
+    storey_list = ",".join(f"#{s}" for s in storeys.values())
+    b.add(f"IFCRELAGGREGATES('{_new_guid()}',$,$,$,#{building},({storey_list}))")
+
+    # Элементы каждого этажа для IfcRelContainedInSpatialStructure
+    contained: Dict[int, List[int]] = {i: [] for i in storeys}
+
+    def _product(ifc_class: str, name: str, profile_x: float, profile_y: float,
+                 depth: float, extr_pos: int, axis_body: str, storey_idx: int) -> int:
+        """
+        Элемент с экструдированной геометрией + привязка к этажу
+        """
+        profile = b.add(
+            f"IFCRECTANGLEPROFILEDEF(.AREA.,$,$,{_f(profile_x)},{_f(profile_y)})"
+        )
+        solid = b.add(
+            f"IFCEXTRUDEDAREASOLID(#{profile},#{extr_pos},#{zdir},{_f(depth)})"
+        )
+        rep = b.add(
+            f"IFCSHAPEREPRESENTATION(#{body_ctx},'Body','SweptSolid',(#{solid}))"
+        )
+        shape = b.add(f"IFCPRODUCTDEFINITIONSHAPE($,$,(#{rep}))")
+        placement = b.add(f"IFCLOCALPLACEMENT($,#{axis_body})")
+        product = b.add(
+            f"{ifc_class}('{_new_guid()}',$,'{name}',$,$,#{placement},#{shape},$,$)"
+        )
+        if storey_idx not in contained:
+            storey_idx = 0
+        contained[storey_idx].append(product)
+        return product
+
+    # --- плиты ---
+    min_b, max_b = bounds['min'], bounds['max']
+    length = max_b[0] - min_b[0]
+    width = max_b[1] - min_b[1]
+    center_x = (max_b[0] + min_b[0]) / 2
+    center_y = (max_b[1] + min_b[1]) / 2
+    for slab in elements['slabs']:
+        pt = b.add(
+            f"IFCCARTESIANPOINT(({_f(center_x)},{_f(center_y)},{_f(slab['z'])}))"
+        )
+        axis = b.add(f"IFCAXIS2PLACEMENT3D(#{pt},$,$)")
+        _product("IFCSLAB", f"Slab at Z={slab['z']:.2f}", length, width,
+                 slab['thickness'], origin_placement, axis, 0)
+
+    # --- стены ---
+    for wall in elements['walls']:
+        start, end = wall['start'], wall['end']
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        wall_len = math.hypot(dx, dy)
+        if wall_len < MIN_WALL_LENGTH:
+            continue
+        cos_a, sin_a = dx / wall_len, dy / wall_len
+        thickness = wall['thickness']
+
+        extr_pt = b.add(f"IFCCARTESIANPOINT((0.,{_f(-thickness / 2)},0.))")
+        extr_pos = b.add(f"IFCAXIS2PLACEMENT3D(#{extr_pt},#{zdir},#{xdir})")
+        pt = b.add(
+            f"IFCCARTESIANPOINT(({_f(start[0])},{_f(start[1])},{_f(start[2])}))"
+        )
+        ref = b.add(f"IFCDIRECTION(({_f(cos_a)},{_f(sin_a)},0.))")
+        axis = b.add(f"IFCAXIS2PLACEMENT3D(#{pt},#{zdir},#{ref})")
+        _product("IFCWALL", "Wall", wall_len, thickness, wall['height'],
+                 extr_pos, axis, wall.get('storey', 0))
+
+    # --- колонны ---
+    for column in elements['columns']:
+        pos = column['position']
+        pt = b.add(f"IFCCARTESIANPOINT(({_f(pos[0])},{_f(pos[1])},{_f(pos[2])}))")
+        axis = b.add(f"IFCAXIS2PLACEMENT3D(#{pt},$,$)")
+        _product("IFCCOLUMN", "Column", column['width'], column['depth'],
+                 column['height'], origin_placement, axis,
+                 column.get('storey', 0))
+
+    # --- привязка элементов к этажам ---
+    for idx, products in contained.items():
+        if products:
+            product_list = ",".join(f"#{p}" for p in products)
+            b.add(
+                f"IFCRELCONTAINEDINSPATIALSTRUCTURE('{_new_guid()}',$,$,$,"
+                f"({product_list}),#{storeys[idx]})"
+            )
+
+    timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    header = (
+        "ISO-10303-21;\n"
+        "HEADER;\n"
+        "FILE_DESCRIPTION(('ViewDefinition [CoordinationView]'),'2;1');\n"
+        f"FILE_NAME('{os.path.basename(output_path)}','{timestamp}',(''),(''),"
+        "'','e57-to-ifc-converter','');\n"
+        "FILE_SCHEMA(('IFC4'));\n"
+        "ENDSEC;\n"
+        "DATA;\n"
+    )
+    footer = "ENDSEC;\nEND-ISO-10303-21;\n"
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(header)
+        f.write("\n".join(b.lines))
+        f.write("\n")
+        f.write(footer)
@@ -0,0 +1,98 @@
+import os
+import sys
+
+# io_uring доступен только на Linux >= 5.1 и при установленном python-liburing.
+# Если чего-то нет - модуль остаётся заглушкой и api.py использует обычную запись.
+try:
+    import liburing
+    HAS_LIBURING = sys.platform == "linux"
+except ImportError:
+    liburing = None
+    HAS_LIBURING = False
+
+# Глубина очереди отправки (SQ) - сколько записей можно накопить до submit
+SQ_ENTRIES = 128
+
+
+def available() -> bool:
+    """
+    Проверка, можно ли использовать io_uring на этой системе
+    """
+    return HAS_LIBURING
+
+
+class UringFileWriter:
+    """
+    Последовательная запись файла через io_uring: чанки накапливаются
+    в очереди отправки и уходят в ядро одним syscall вместо write() на чанк
+    """
+
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.offset = 0
+        self.pending = 0
+        # Буферы, стоящие в очереди: в SQE попадает только адрес памяти,
+        # поэтому буфер обязан жить до завершения записи ядром
+        self._pending_bufs = []
+        self.ring = liburing.io_uring()
+        liburing.io_uring_queue_init(SQ_ENTRIES, self.ring, 0)
+
+    def write(self, chunk: bytes):
+        """
+        Поставить чанк в очередь; при заполнении очереди - отправить пакетом
+        """
+        buf = bytearray(chunk)
+        sqe = liburing.io_uring_get_sqe(self.ring)
+        if sqe is None:
+            self._submit_and_wait()
+            sqe = liburing.io_uring_get_sqe(self.ring)
+        liburing.io_uring_prep_write(sqe, self.fd, buf, len(buf), self.offset)
+        # Ожидаемая длина записи - для сверки с res при завершении
+        sqe.user_data = len(buf)
+        self._pending_bufs.append(buf)
+        self.offset += len(buf)
+        self.pending += 1
+        if self.pending >= SQ_ENTRIES:
+            self._submit_and_wait()
+
+    def _submit_and_wait(self):
+        """
+        Отправить накопленные записи и дождаться их завершения
+        """
+        if self.pending == 0:
+            return
+        liburing.io_uring_submit(self.ring)
+        cqe = liburing.io_uring_cqe()
+        try:
+            for _ in range(self.pending):
+                liburing.io_uring_wait_cqe(self.ring, cqe)
+                res = cqe.res
+                expected = cqe.user_data
+                liburing.io_uring_cqe_seen(self.ring, cqe)
+                if res < 0:
+                    raise OSError(-res, os.strerror(-res))
+                # Частичная запись молча обрезала бы файл: офсеты
+                # следующих чанков уже выданы вперёд
+                if res != expected:
+                    raise OSError(
+                        f"io_uring: неполная запись ({res} из {expected} байт)"
+                    )
+        finally:
+            self.pending = 0
+            self._pending_bufs.clear()
+
+    def close(self):
+        """
+        Дописать остаток очереди и освободить ресурсы
+        """
+        try:
+            self._submit_and_wait()
+        finally:
+            liburing.io_uring_queue_exit(self.ring)
+            os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()